@@ -1,7 +1,8 @@
 #!/usr/bin/python
 # A script for archiving pc bf4 battlelog player data, along with battle reports.
 # REQUIRES:
-#   aiohttp (python3 -m pip install aiohttp)
+#   aiohttp, orjson (python3 -m pip install aiohttp orjson)
+#   uvloop is used if installed (optional, not available on Windows)
 # NOTES:
 #   Ensure you have access to all user profile data (battle reports etc) otherwise they cannot be saved.
 #   All files will be placed in the current directory.
@@ -9,190 +10,392 @@
 #   1: Profile name - e.g 'Brisppy'
 #   2: Path to cookie file - e.g 'C:\\Users\\Brisppy\\cookie.txt' - Fetch using 'Get cookies.txt' Chrome extension.
 #       - Use 2 slashes for Windows paths.
+#   --ndjson: Optional - write all battle reports to a single 'reports.ndjson' file (one report per line) rather than a
+#       file per report. The id of each report is also listed in 'reports.ndjson.ids'.
 
 import os
 import sys
-import math
-import json
-import time
-import numpy
+import contextlib
+import orjson
 import aiohttp
 import asyncio
-import requests
+import random
 from pathlib import Path
 import http.cookiejar as cookielib
 
 
-def battlelogApiFetch(endpoint, headers, cookie):
+# Raised on unrecoverable errors so that sessions are closed cleanly before the script exits.
+class BattlelogError(RuntimeError):
+    pass
+
+
+# Limits the number of concurrent requests. Unlike a semaphore the limit can be changed at any time, and is checked as
+# each request is admitted, so a lowered limit applies to the next request rather than after queued requests drain.
+class ConcurrencyLimiter:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    async def setLimit(self, limit):
+        async with self._condition:
+            self.limit = limit
+            # Only wake as many waiting requests as there are newly free slots
+            self._condition.notify(max(0, limit - self.in_flight))
+
+
+async def battlelogApiFetch(session, endpoint):
     url = 'https://battlelog.battlefield.com/bf4' + endpoint
     while True:
         try:
-            r = requests.get(url, headers=headers, cookies=cookie)
-            if r.status_code == 504:
-                time.sleep(5)
+            async with session.get(url) as r:
+                if r.status == 504:
+                    await asyncio.sleep(5)
+                    continue
+                elif r.status == 403:
+                    raise BattlelogError('Error 403 Forbidden received. Most likely IP blocked.')
+                try:
+                    return orjson.loads(await r.read())
+                except orjson.JSONDecodeError:
+                    return {}
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise BattlelogError('Error accessing battlelog API.') from e
+
+
+# Returns the number of seconds to wait before retrying a request. The server's Retry-After header is honoured when
+# present, up to 5 minutes as the request's slot is held while waiting, otherwise exponential backoff with full jitter
+# is used so concurrent retries don't all fire together.
+def retryDelay(attempt, retry_after=None):
+    if retry_after and retry_after.isdigit():
+        return min(300, int(retry_after))
+    return random.uniform(0, min(60, 1.0 * (2 ** attempt)))
+
+
+# Repaints the progress line from the shared report counters.
+def printProgress(progress):
+    sys.stdout.write('\rINFO: ok=' + str(progress['ok']) + ' retry=' + str(progress['retry']) + ' throttled=' + str(progress['throttled']) + ' fail=' + str(progress['fail']) + ' limit=' + str(progress['limit']) + '  ')
+    sys.stdout.flush()
+
+
+# Repaints the progress line every 100ms until cancelled, rather than writing to stdout on every response.
+async def progressPrinter(progress):
+    while True:
+        await asyncio.sleep(0.1)
+        printProgress(progress)
+
+
+# Returns the path of the file listing the id of each report in an ndjson file, one per line.
+def ndjsonIdsPath(ndjson_path):
+    return ndjson_path.with_name(ndjson_path.name + '.ids')
+
+
+# Appends reports to an ndjson file, recording each report's id in the ids file alongside it so that later runs can tell
+# which reports are archived without decoding every report. The id is written after its report, so an interrupted write
+# can at worst cause a report to be fetched again.
+class NdjsonWriter:
+    def __init__(self, ndjson_path):
+        self.ndjson_path = ndjson_path
+        self.ids_path = ndjsonIdsPath(ndjson_path)
+
+    def __enter__(self):
+        self._reports = open(self.ndjson_path, 'ab')
+        self._ids = open(self.ids_path, 'ab')
+        return self
+
+    def __exit__(self, *exc_info):
+        self._reports.close()
+        self._ids.close()
+
+    def write(self, report):
+        self._reports.write(orjson.dumps(report) + b'\n')
+        self._ids.write(str(report['id']).encode() + b'\n')
+
+
+# Writes a report to its own file in reports_dir, or through ndjson_writer if one is open. Report files are written to a
+# temporary file first and then renamed, so an interrupted write never leaves a partial <id>.json behind.
+def writeReport(report, reports_dir, ndjson_writer=None):
+    if ndjson_writer is not None:
+        ndjson_writer.write(report)
+    else:
+        temp_path = reports_dir / (str(report['id']) + '.json.tmp')
+        temp_path.write_bytes(orjson.dumps(report))
+        os.replace(temp_path, reports_dir / (str(report['id']) + '.json'))
+
+
+# Truncates an ndjson file back to its last complete line, so lines appended to it aren't joined onto a line left
+# incomplete by an interrupted run.
+def truncateIncompleteLine(ndjson_path):
+    if not ndjson_path.exists():
+        return
+    with open(ndjson_path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b'\n')
+            if newline != -1:
+                f.truncate(start + newline + 1)
+                return
+            end = start
+        f.truncate(0)
+
+
+# Returns the ids of reports archived by a previous run, either as files in reports_dir or from the ids file of the
+# ndjson file. An ndjson file written before ids files existed is decoded once to create its ids file.
+def archivedReportIds(reports_dir, ndjson_path=None):
+    if ndjson_path is None:
+        return {path.stem for path in reports_dir.glob('*.json')}
+    ids_path = ndjsonIdsPath(ndjson_path)
+    if not ndjson_path.exists():
+        # Any ids file left without its ndjson file is stale
+        ids_path.unlink(missing_ok=True)
+        return set()
+    if ids_path.exists():
+        with open(ids_path, 'rb') as f:
+            return {line.strip().decode() for line in f if line.strip()}
+    report_ids = set()
+    with open(ndjson_path, 'rb') as f:
+        for line in f:
+            try:
+                report_ids.add(str(orjson.loads(line)['id']))
+            except (orjson.JSONDecodeError, KeyError, TypeError):
+                # Skip lines left incomplete by an interrupted run
                 continue
-            elif r.status_code == 403:
-                print('ERROR: Error 403 Forbidden received. Most likely IP blocked.')
-                sys.exit(1)
-            else:
-                break
-        except BaseException as e:
-            print('ERROR: Error accessing battlelog API.')
-            print('ERROR:', e)
-            sys.exit(1)
+    ids_path.write_bytes(b''.join(report_id.encode() + b'\n' for report_id in report_ids))
+    return report_ids
+
+
+# Returns just the battle reports from a report list response. A response without the expected envelope (e.g. an error
+# page or an expired session) raises rather than being mistaken for the end of the report list.
+def gameReports(response):
     try:
-        return json.loads(r.text)
-    except:
-        return {}
-
-
-# Function for fetching battlereports. A symbol is printed for each response:
-#   o = success
-#   . = bad response (retry after 5s)
-#   x = failed
-#   X = failed due to 403 (retry after 10m)
-async def battlelogRetrieveReport(session, url):
-    attempt = 0
+        return response['data']['gameReports'] or []
+    except (KeyError, TypeError):
+        raise BattlelogError('Unexpected response received while fetching battle reports. Cookies may have expired.') from None
+
+
+# Adjusts the number of concurrent report requests every 5s, from the counters in progress. The limit is halved when
+# more than 5% of responses in the last window were throttled, and raised by one after a window of over 50 successes
+# with none throttled, up to maximum.
+async def adaptConcurrency(limiter, progress, maximum, minimum=2):
+    last_ok = progress['ok']
+    last_throttled = progress['throttled']
     while True:
-        attempt += 1
-        try:
-            async with session.get(url) as resp:
-                assert resp.status == 200
-                report = await resp.json()
-                if report and await resp.text() != 'null':
-                    sys.stdout.write("o")
-                    sys.stdout.flush()
-                    return report
-                elif attempt >= 6:
-                    sys.stdout.write("x")
-                    sys.stdout.flush()
-                    return {}
-                else:
-                    # No data returned, try again after 5s - possibly rate limited
-                    sys.stdout.write(".")
-                    sys.stdout.flush()
-                    time.sleep(3)
-                    continue
-        except AssertionError:
-            sys.stdout.write("X")
-            sys.stdout.flush()
-            time.sleep(600)
-            continue
-        except aiohttp.client_exceptions.ClientOSError:
-            time.sleep(10)
+        await asyncio.sleep(5)
+        ok = progress['ok'] - last_ok
+        throttled = progress['throttled'] - last_throttled
+        last_ok = progress['ok']
+        last_throttled = progress['throttled']
+        if throttled > 0.05 * ok:
+            new_limit = max(minimum, limiter.limit // 2)
+        elif not throttled and ok > 50:
+            new_limit = min(maximum, limiter.limit + 1)
+        else:
             continue
+        await limiter.setLimit(new_limit)
+        progress['limit'] = new_limit
+
+
+# Function for fetching battlereports. A counter in progress is incremented for each response:
+#   ok = success
+#   retry = bad response, other error status or network error (retry after backoff)
+#   throttled = 403/429/503 (retry after Retry-After or backoff)
+#   fail = failed after 6 attempts
+# At most as many reports as the limiter allows are fetched at once. Each report is written to disk as soon as it is
+# retrieved and its id returned, so only reports that are in flight are held in memory.
+async def battlelogRetrieveReport(session, limiter, url, reports_dir, ndjson_writer, progress):
+    async with limiter:
+        attempt = 0
+        while True:
+            attempt += 1
+            # The response is read in full and released before any backoff, so its connection isn't held while waiting
+            try:
+                async with session.get(url) as resp:
+                    status = resp.status
+                    retry_after = resp.headers.get('Retry-After')
+                    body = await resp.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Transient network errors (e.g. a kept-alive connection closed by the server) are retried after a
+                # backoff, up to the same number of attempts as an empty response
+                if attempt >= 6:
+                    raise BattlelogError('Error accessing battlelog API.') from e
+                progress['retry'] += 1
+                await asyncio.sleep(retryDelay(attempt))
+                continue
+            if status in (403, 429, 503):
+                # Rate limited - always retried, and counted towards adapting the concurrency limit
+                progress['throttled'] += 1
+                await asyncio.sleep(retryDelay(attempt, retry_after))
+                continue
+            elif status != 200:
+                # Any other error status (e.g. a deleted report) is retried a limited number of times before failing
+                if attempt >= 6:
+                    progress['fail'] += 1
+                    return None
+                progress['retry'] += 1
+                await asyncio.sleep(retryDelay(attempt, retry_after))
+                continue
+            try:
+                report = orjson.loads(body)
+            except orjson.JSONDecodeError:
+                # An empty or malformed body is treated as no data returned
+                report = None
+            if report:
+                # Written from a worker thread so the write overlaps with other in-flight requests
+                try:
+                    await asyncio.to_thread(writeReport, report, reports_dir, ndjson_writer)
+                except OSError as e:
+                    raise BattlelogError('Error writing to disk.') from e
+                progress['ok'] += 1
+                return report['id']
+            elif attempt >= 6:
+                progress['fail'] += 1
+                return None
+            else:
+                # No data returned, try again after a backoff - possibly rate limited
+                progress['retry'] += 1
+                await asyncio.sleep(retryDelay(attempt))
+                continue
 
 async def main():
     # Grab and store cookie data
     cookie = cookielib.MozillaCookieJar(str(Path(sys.argv[2])))
     cookie.load()
+    cookies = {each.name: each.value for each in cookie}
     # Store profile name
     profile_name = sys.argv[1]
-    # Fetch profile data
-    headers = {'X-AjaxNavigation': '1', 'X-Requested-With': 'XMLHttpRequest'}
-    print('INFO: Fetching profile data...', end='\r')
-    profile_data = battlelogApiFetch('/user/' + profile_name + '/', headers, cookie)
-    print('INFO: Fetching profile data... Done')
-    profile_id = profile_data['context']['activitystream'][0]['persona']['personaId']
-    user_id = profile_data['context']['activitystream'][0]['persona']['userId']
-    club_id = profile_data['context']['profileCommon']['club']['id']
-    # Fetch active club data
-    print('INFO: Fetching active club data...', end='\r')
-    club_data = battlelogApiFetch('/platoons/view/' + club_id + '/', headers, cookie)
-    print('INFO: Fetching active club data... Done')
-    # Fetch other stats
-    # Weapons
-    print('INFO: Fetching weapon stats...', end='\r')
-    weapon_stats = battlelogApiFetch('/warsawWeaponsPopulateStats/'+ profile_id + '/1/stats/', headers, cookie)
-    print('INFO: Fetching weapon stats... Done')
-    # Vehicles
-    print('INFO: Fetching vehicle stats...', end='\r')
-    vehicle_stats = battlelogApiFetch('/warsawvehiclesPopulateStats/'+ profile_id + '/1/stats/', headers, cookie)
-    print('INFO: Fetching vehicle stats... Done')
-    # Detailed
-    print('INFO: Fetching detailed stats...', end='\r')
-    detailed_stats = battlelogApiFetch('/warsawdetailedstatspopulate/'+ profile_id + '/1/stats/', headers, cookie)
-    print('INFO: Fetching detailed stats... Done')
-    # Assignments
-    print('INFO: Fetching assignment stats...', end='\r')
-    assignment_stats = battlelogApiFetch('/soldier/missionsPopulateStats/'+ profile_name + '/' + profile_id + '/' + user_id + '/1/', headers, cookie)
-    print('INFO: Fetching assignment stats... Done')
-    # Awards
-    print('INFO: Fetching award stats...', end='\r')
-    award_stats = battlelogApiFetch('/warsawawardspopulate/'+ profile_id + '/1/stats/', headers, cookie)
-    print('INFO: Fetching award stats... Done')
-    # Generate list of battlereports
-    print('INFO: Fetching reports, this may take a while...', end='\r')
-    report_list = []
-    # Fetch initial report list
-    try:
-        report_list.extend(battlelogApiFetch('/warsawbattlereportspopulate/' + profile_id + '/2048/1/', headers, cookie)['data']['gameReports'][:])
-    except KeyError:
-        print('ERROR: Battle reports probably are hidden by user (See ' + 'https://battlelog.battlefield.com/bf4/soldier/' + profile_name + '/battlereports/' +  profile_id + '/pc/' + ').')
-        sys.exit(1)
-    noDataReturned = 0
-    while True:
-        # Fetch next x number of reports, using the most recent report
-        reports = battlelogApiFetch('/warsawbattlereportspopulatemore/' + profile_id + '/2048/1/' + str(report_list[-1]['createdAt']), headers, cookie)
-        # Break loop when no more reports can be returned.
-        if not reports['data']['gameReports'] and noDataReturned >= 5:
-            break
-        elif not reports['data']['gameReports']:
-            noDataReturned += 1
-            continue
-        else:
-            noDataReturned = 0
-            report_list.extend(reports['data']['gameReports'][:])
-            print('INFO: Fetching reports, this may take a while... ' + str(len(report_list)) + ' found.', end='\r')
-            continue
-    print('INFO: Fetching reports, this may take a while...                                                 ', end='\r')
-    print('INFO: Fetching reports, this may take a while... Done')
-    print('INFO: Total reports:', len(report_list))
-    # Fetch data for individual reports
-    print('INFO: Now fetching individual reports, this can take a LONG time...')
-    battlelog_reports = []
-    cookies = {}
-    for each in cookie:
-        cookies[each.name] = each.value
-    # First the list of reports has to be split into smaller chunks as I was encountering issues with rate limiting when using a single session.
-    report_list = numpy.array_split(report_list, math.ceil(len(report_list)/20))
+    ndjson = '--ndjson' in sys.argv[3:]
+    # Compressed responses are requested explicitly as some deployments only compress when the header is sent
+    headers = {'X-AjaxNavigation': '1', 'X-Requested-With': 'XMLHttpRequest', 'Accept-Encoding': 'gzip, deflate',
+               'Connection': 'keep-alive'}
     timeout = aiohttp.ClientTimeout(total=6000)
-    for report_list_chunk in range(len(report_list)):
-        async with aiohttp.ClientSession(timeout=timeout, headers=headers, cookies=cookies) as session:
-            tasks = []
-            for report_number in range(len(report_list[report_list_chunk])):
-                url = 'https://battlelog.battlefield.com/bf4/battlereport/loadgeneralreport/' + str(report_list[report_list_chunk][report_number]['gameReportId']) + '/1/' + profile_id + '/'
-                tasks.append(asyncio.ensure_future(battlelogRetrieveReport(session, url)))
-            reports = await asyncio.gather(*tasks)
+    # Bounds the number of concurrent requests sent when fetching reports
+    concurrency = 20
+    limiter = ConcurrencyLimiter(concurrency)
+    # A single long-lived session is shared by all requests so connections are kept alive between them, with the number
+    # of connections bounded to avoid being rate limited.
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency, keepalive_timeout=30)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers, cookies=cookies,
+                                     auto_decompress=True) as session:
+        # Fetch profile data
+        print('INFO: Fetching profile data...', end='\r')
+        profile_data = await battlelogApiFetch(session, '/user/' + profile_name + '/')
+        print('INFO: Fetching profile data... Done')
+        profile_id = profile_data['context']['activitystream'][0]['persona']['personaId']
+        user_id = profile_data['context']['activitystream'][0]['persona']['userId']
+        club_id = profile_data['context']['profileCommon']['club']['id']
+        # Fetch active club data along with weapon, vehicle, detailed, assignment and award stats concurrently
+        print('INFO: Fetching club data and stats...', end='\r')
+        stats_endpoint = '/{}/' + profile_id + '/1/stats/'
+        club_data, weapon_stats, vehicle_stats, detailed_stats, assignment_stats, award_stats = await asyncio.gather(
+            battlelogApiFetch(session, '/platoons/view/' + club_id + '/'),
+            battlelogApiFetch(session, stats_endpoint.format('warsawWeaponsPopulateStats')),
+            battlelogApiFetch(session, stats_endpoint.format('warsawvehiclesPopulateStats')),
+            battlelogApiFetch(session, stats_endpoint.format('warsawdetailedstatspopulate')),
+            battlelogApiFetch(session, '/soldier/missionsPopulateStats/'+ profile_name + '/' + profile_id + '/' + user_id + '/1/'),
+            battlelogApiFetch(session, stats_endpoint.format('warsawawardspopulate')))
+        print('INFO: Fetching club data and stats... Done')
+        # Generate list of battlereports
+        print('INFO: Fetching reports, this may take a while...', end='\r')
+        # Reports are keyed by id so that a report returned by more than one request is only stored once
+        report_list = {}
+        # Fetch initial report list
+        try:
+            reports = (await battlelogApiFetch(session, '/warsawbattlereportspopulate/' + profile_id + '/2048/1/'))['data']['gameReports']
+        except KeyError:
+            raise BattlelogError('Battle reports probably are hidden by user (See ' + 'https://battlelog.battlefield.com/bf4/soldier/' + profile_name + '/battlereports/' +  profile_id + '/pc/' + ').')
+        more_endpoint = '/warsawbattlereportspopulatemore/' + profile_id + '/2048/1/{}'
+        while reports:
             for report in reports:
-                if report:
-                    battlelog_reports.append(report)
-                else:
-                    continue
+                report_list[report['gameReportId']] = report
+            print('INFO: Fetching reports, this may take a while... ' + str(len(report_list)) + ' found.', end='\r')
+            # Fetch next x number of reports, using the oldest report fetched so far as the cursor
+            cursor = reports[-1]['createdAt']
+            endpoint = more_endpoint.format(cursor)
+            reports = gameReports(await battlelogApiFetch(session, endpoint))
+            # An empty response doesn't always mean there are no more reports (e.g. when throttled), so confirm it with
+            # several more requests from the same cursor, each after a short jittered delay. Loop ends when no more
+            # reports can be returned.
+            retries = 0
+            while not reports and retries < 5:
+                retries += 1
+                await asyncio.sleep(random.uniform(0.5, 2.0))
+                reports = gameReports(await battlelogApiFetch(session, endpoint))
+        report_list = list(report_list.values())
+        print('INFO: Fetching reports, this may take a while...                                                 ', end='\r')
+        print('INFO: Fetching reports, this may take a while... Done')
+        print('INFO: Total reports:', len(report_list))
+        # Fetch data for individual reports
+        print('INFO: Now fetching individual reports, this can take a LONG time...')
+        stats_directory = Path(os.getcwd(), 'bf4-battlelog-archive', profile_name)
+        reports_dir = stats_directory / 'reports'
+        try:
+            (stats_directory if ndjson else reports_dir).mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            raise BattlelogError('Error writing to disk.') from e
+        # Only fetch reports which haven't already been archived by a previous run
+        ndjson_path = stats_directory / 'reports.ndjson' if ndjson else None
+        try:
+            if ndjson:
+                truncateIncompleteLine(ndjson_path)
+                truncateIncompleteLine(ndjsonIdsPath(ndjson_path))
+            archived = archivedReportIds(reports_dir, ndjson_path)
+        except OSError as e:
+            raise BattlelogError('Error reading previously archived reports.') from e
+        todo = [report for report in report_list if str(report['gameReportId']) not in archived]
+        print('INFO: ' + str(len(report_list) - len(todo)) + ' reports already archived, ' + str(len(todo)) + ' to fetch.')
+        progress = {'ok': 0, 'retry': 0, 'throttled': 0, 'fail': 0, 'limit': concurrency}
+        progress_task = asyncio.create_task(progressPrinter(progress))
+        adapt_task = asyncio.create_task(adaptConcurrency(limiter, progress, concurrency))
+        with (NdjsonWriter(ndjson_path) if ndjson else contextlib.nullcontext()) as ndjson_writer:
+            url_template = 'https://battlelog.battlefield.com/bf4/battlereport/loadgeneralreport/{}/1/' + profile_id + '/'
+            urls = [url_template.format(report['gameReportId']) for report in todo]
+            tasks = [asyncio.create_task(battlelogRetrieveReport(session, limiter, url, reports_dir, ndjson_writer, progress)) for url in urls]
+            for task in asyncio.as_completed(tasks):
+                await task
+        progress_task.cancel()
+        adapt_task.cancel()
+    printProgress(progress)
     print('\nINFO: Done fetching reports.')
     # Write data to the current directory
     print('INFO: Writing data to disk...', end='\r')
-    while True:
-        try:
-            stats_directory = Path(os.getcwd(), 'bf4-battlelog-archive', profile_name)
-            os.makedirs(Path(stats_directory, 'reports'), exist_ok=True)
-            with open(Path(stats_directory, 'profile_data.json'), 'w') as f: f.write(str(profile_data))
-            with open(Path(stats_directory, 'club_data.json'), 'w') as f: f.write(str(club_data))
-            with open(Path(stats_directory, 'weapon_stats.json'), 'w') as f: f.write(str(weapon_stats))
-            with open(Path(stats_directory, 'vehicle_stats.json'), 'w') as f: f.write(str(vehicle_stats))
-            with open(Path(stats_directory, 'detailed_stats.json'), 'w') as f: f.write(str(detailed_stats))
-            with open(Path(stats_directory, 'assignment_stats.json'), 'w') as f: f.write(str(assignment_stats))
-            with open(Path(stats_directory, 'award_stats.json'), 'w') as f: f.write(str(award_stats))
-            with open(Path(stats_directory, 'report_list.json'), 'w') as f: f.write(str(report_list))
-            for report_number in range(len(battlelog_reports)):
-                with open(Path(stats_directory, 'reports', str(battlelog_reports[report_number]['id']) + '.json'), 'w') as f: f.write(str(battlelog_reports[report_number]))
-            print('INFO: Writing data to disk... Done')
-            break
-        except BaseException as e:
-            print('ERROR: Error writing to disk.')
-            print('ERROR:', e)
-            sys.exit(1)
+    try:
+        for name, data in [('profile_data', profile_data), ('club_data', club_data), ('weapon_stats', weapon_stats),
+                           ('vehicle_stats', vehicle_stats), ('detailed_stats', detailed_stats),
+                           ('assignment_stats', assignment_stats), ('award_stats', award_stats),
+                           ('report_list', report_list)]:
+            (stats_directory / (name + '.json')).write_bytes(orjson.dumps(data))
+    except OSError as e:
+        raise BattlelogError('Error writing to disk.') from e
+    print('INFO: Writing data to disk... Done')
 
 
 if __name__=='__main__':
-    asyncio.run(main())
+    # Use uvloop's faster event loop if it is installed (it isn't available on Windows). On Python 3.12+ it is passed as
+    # the loop factory, as uvloop.install() relies on the deprecated event loop policy API.
+    run_options = {}
+    try:
+        import uvloop
+        if sys.version_info >= (3, 12):
+            run_options['loop_factory'] = uvloop.new_event_loop
+        else:
+            uvloop.install()
+    except ImportError:
+        pass
+    try:
+        asyncio.run(main(), **run_options)
+    except BattlelogError as e:
+        print('ERROR:', e)
+        if e.__cause__ is not None:
+            print('ERROR:', e.__cause__)
+        sys.exit(1)